@@ -27,12 +27,13 @@ def is_anaddb_var(varname):
     return varname in get_codevars()["anaddb"]
 
 
+# Add include statement
+# FIXME: These variables should be added to the database.
+_EXTRA_ABIVARS = frozenset(["include", "xyzfile"])
+
 def is_abivar(varname):
     """True if s is an ABINIT variable."""
-    # Add include statement
-    # FIXME: These variables should be added to the database.
-    extra = ["include", "xyzfile"]
-    return varname in get_codevars()["abinit"] or varname in extra
+    return varname in get_codevars()["abinit"] or varname in _EXTRA_ABIVARS
 
 
 # TODO: Move to new directory
@@ -8,7 +8,7 @@ from collections import OrderedDict
 
 # Unit names.
 # Operators.
-from abipy.abio.abivar_database.variables import ABI_UNITS, ABI_OPS
+from abipy.abio.abivar_database.variables import ABI_UNITS, ABI_OPS, get_codevars
 
 ##############
 # Public API #
@@ -17,7 +17,6 @@ from abipy.abio.abivar_database.variables import ABI_UNITS, ABI_OPS
 
 def get_abinit_variables():
     """Returns the database with the description of the ABINIT variables."""
-    from abipy.abio.abivar_database.variables import get_codevars
     return get_codevars()["abinit"]
 
 
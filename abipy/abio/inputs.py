@@ -5,8 +5,10 @@ The syntax is similar to the one used in ABINIT with small differences.
 from __future__ import print_function, division, unicode_literals, absolute_import
 
 import os
+import sys
+import numbers
+import operator
 import collections
-import warnings
 import itertools
 import copy
 import time
@@ -17,6 +19,7 @@ import numpy as np
 
 from collections import OrderedDict, MutableMapping
 from monty.collections import dict2namedtuple
+from monty.dev import get_ncpus
 from monty.string import is_string, list_strings
 from monty.json import MontyDecoder, MSONable
 from pymatgen.core.units import Energy
@@ -38,14 +41,30 @@ from abipy.flowtk import abiobjects as aobj
 import logging
 logger = logging.getLogger(__file__)
 
+# dict preserves the insertion order in py3.7 and it's faster and smaller than OrderedDict.
+# Use OrderedDict with older versions so that variables are still grouped by `topics`.
+_VarsDict = dict if sys.version_info >= (3, 7) else OrderedDict
+
+
+def _dataset_banner(idt):
+    """String with the header printed by MultiDataset.to_string before the variables of dataset ``idt``."""
+    header = "### DATASET %d ###" % idt
+    hbar = len(header) * "#"
+    return "\n%s\n%s\n%s\n" % (hbar, header, hbar)
+
+
+# Strings used by MultiDataset.to_string, precomputed for the first datasets.
+_DS_POST = tuple(str(idt) for idt in range(1, 257))
+_DS_BANNER = tuple(_dataset_banner(idt) for idt in range(1, 257))
+
 
 # List of Abinit variables used to specify the structure.
 # This variables should not be passed to set_vars since
 # they will be generated with structure.to_abivars()
-GEOVARS = set([
+GEOVARS = frozenset([
     "acell",
     "rprim",
-    "rprimd"
+    "rprimd",
     "angdeg",
     "xred",
     "xcart",
@@ -96,6 +115,104 @@ _IRDVARS = set([
     "ird1wf",
 ])
 
+# Cache used by _get_pseudos_for_structure.
+# Maps (ids of the pseudos in the table, species) --> (pseudos in the table, list of pseudos).
+# The key depends on the pseudos and not on the table since MultiDataset.from_inputs
+# creates a new table from the same pseudos. The references stored in the value
+# prevent the reuse of the ids for other objects.
+_PSEUDOS_FOR_STRUCTURE_CACHE = {}
+
+
+def _get_pseudos_for_structure(pseudos, structure):
+    """
+    Return the list of |Pseudo| objects in ``pseudos`` to be used for ``structure``.
+    The result is cached if ``pseudos`` is a |PseudoTable| since MultiDataset
+    uses the same table to build several inputs. A new list is returned
+    at each call, only the |Pseudo| objects are shared by the callers.
+    """
+    if not isinstance(pseudos, PseudoTable):
+        return PseudoTable.as_table(pseudos).get_pseudos_for_structure(structure)
+
+    items = tuple(pseudos)
+    key = (tuple(id(p) for p in items), tuple(str(sp) for sp in structure.types_of_specie))
+    value = _PSEUDOS_FOR_STRUCTURE_CACHE.get(key)
+    if value is None:
+        if len(_PSEUDOS_FOR_STRUCTURE_CACHE) > 128: _PSEUDOS_FOR_STRUCTURE_CACHE.clear()
+        value = (items, pseudos.get_pseudos_for_structure(structure))
+        _PSEUDOS_FOR_STRUCTURE_CACHE[key] = value
+
+    return list(value[1])
+
+
+# Cache used by _pseudo_as_dict. Maps id(pseudo) --> (pseudo, pseudo.as_dict())
+_PSEUDO_AS_DICT_CACHE = {}
+
+
+def _pseudo_as_dict(pseudo):
+    """
+    Return a copy of ``pseudo.as_dict()``.
+    Pseudos are not changed after the initialization so the dictionary is computed only once.
+    """
+    value = _PSEUDO_AS_DICT_CACHE.get(id(pseudo))
+    if value is None:
+        if len(_PSEUDO_AS_DICT_CACHE) > 1024: _PSEUDO_AS_DICT_CACHE.clear()
+        value = (pseudo, pseudo.as_dict())
+        _PSEUDO_AS_DICT_CACHE[id(pseudo)] = value
+
+    return dict(value[1])
+
+
+def invalidate_pseudo_cache():
+    """Clear the internal caches storing pseudopotential data. Mainly used in the unit tests."""
+    _PSEUDO_AS_DICT_CACHE.clear()
+    _PSEUDOS_FOR_STRUCTURE_CACHE.clear()
+
+
+def _copy_var_value(value, memo=None):
+    """
+    Return a copy of the value of a variable.
+    ndarray.copy is much faster than the generic copy.deepcopy.
+    """
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        return value.copy()
+    return copy.deepcopy(value, memo)
+
+
+def _structure_key(structure):
+    """
+    Return hashable object with the lattice, the reduced coordinates and the species of ``structure``.
+    Used to detect in-place modifications of structures whose results are cached.
+    """
+    return (structure.lattice.matrix.tobytes(), structure.frac_coords.tobytes(),
+            tuple(site.species_string for site in structure))
+
+
+def _format_variable(name, value):
+    """
+    Return the string with the declaration of variable ``name`` in the input file.
+    Equivalent to ``str(InputVariable(name, value))`` but scalar values and strings,
+    the most common case, are formatted without creating an |InputVariable|.
+    """
+    if value is None: return ""
+    if isinstance(value, numbers.Number):
+        return " " + name + " " + str(value)
+    if is_string(value) and value:
+        return " " + name + " " + value
+
+    return str(InputVariable(name, value))
+
+
+def _as_3col(values):
+    """
+    Convert ``values`` (e.g. list of k-points or shifts) into a C-contiguous array with shape (-1, 3).
+    The dtype of ``values`` is preserved so that e.g. integer shifts are still written as integers.
+    """
+    values = np.ascontiguousarray(values)
+    if values.dtype == object:
+        raise TypeError("Expecting array of numbers but got: %s" % str(values))
+    return values.reshape(-1, 3)
+
+
 # FIXME __mul__ operator in pymatgen should allow for grouping atoms by individual cells
 # The present version group by image.
 #def _repeat_array(name, values, from_natom, numcells):
@@ -129,6 +246,27 @@ class AbstractInput(six.with_metaclass(abc.ABCMeta, MutableMapping, object)):
         self._check_varname(key)
         return self.vars.__setitem__(key, value)
 
+    # The mixin methods of MutableMapping are implemented in python on top of the ABC protocol.
+    # Here we forward the read-only methods to the underlying dict for performance reasons.
+    # update and setdefault are not forwarded since they must call __setitem__ to validate the names.
+    def __contains__(self, key):
+        return key in self.vars
+
+    def keys(self):
+        return self.vars.keys()
+
+    def items(self):
+        return self.vars.items()
+
+    def values(self):
+        return self.vars.values()
+
+    def get(self, key, default=None):
+        return self.vars.get(key, default)
+
+    def pop(self, key, *args):
+        return self.vars.pop(key, *args)
+
     def __repr__(self):
         return "<%s at %s>" % (self.__class__.__name__, id(self))
 
@@ -140,11 +278,16 @@ class AbstractInput(six.with_metaclass(abc.ABCMeta, MutableMapping, object)):
         Write the input file to file to ``filepath``.
         """
         dirname = os.path.dirname(filepath)
-        if not os.path.exists(dirname): os.makedirs(dirname)
+        if dirname:
+            # Single call instead of exists + makedirs (os.makedirs does not support exist_ok in py2).
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname): raise
 
         # Write the input file.
         with open(filepath, "wt") as fh:
-            fh.write(str(self))
+            fh.write(self.to_string())
 
     def deepcopy(self):
         """Deep copy of the input."""
@@ -159,11 +302,32 @@ class AbstractInput(six.with_metaclass(abc.ABCMeta, MutableMapping, object)):
 
             input.set_vars(ecut=10, ionmov=3)
         """
-        kwargs.update(dict(*args))
+        # Most of the callers use keyword arguments only. Don't build a new dict in this case.
+        if args: kwargs.update(dict(*args))
         for varname, varvalue in kwargs.items():
             self[varname] = varvalue
         return kwargs
 
+    def update_vars(self, mapping):
+        """
+        Set the value of the variables stored in the dictionary ``mapping``.
+        Equivalent to ``input.set_vars(**mapping)`` but the dictionary is not copied.
+        Return ``mapping``.
+        """
+        for varname, varvalue in mapping.items():
+            self[varname] = varvalue
+        return mapping
+
+    def _set_vars_unchecked(self, *args, **kwargs):
+        """
+        Set the value of the variables without validating the names.
+        Return dict with the variables added to the input.
+        Used internally when the names are known to be valid e.g. when they come from another input.
+        """
+        if args: kwargs.update(dict(*args))
+        self.vars.update(kwargs)
+        return kwargs
+
     def set_vars_ifnotin(self, *args, **kwargs):
         """
         Set the value of the variables but only if the variable is not already present.
@@ -173,7 +337,7 @@ class AbstractInput(six.with_metaclass(abc.ABCMeta, MutableMapping, object)):
 
             input.set_vars(ecut=10, ionmov=3)
         """
-        kwargs.update(dict(*args))
+        if args: kwargs.update(dict(*args))
         added = {}
         for varname, varvalue in kwargs.items():
             if varname not in self:
@@ -299,6 +463,11 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
     """
     Error = AbinitInputError
 
+    # Default values used for objects unpickled from files produced by older versions.
+    _spell_check = False
+    _mnemonics = False
+    _comment = None
+
     def __init__(self, structure, pseudos, pseudo_dir=None, comment=None, decorators=None, abi_args=None,
                  abi_kwargs=None, tags=None):
         """
@@ -317,6 +486,8 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
             tags: list/set of tags describing the input
         """
         self._spell_check = True
+        self._mnemonics = False
+        self._comment = comment
 
         # Internal dict with variables. we use an ordered dict so that
         # variables will be likely grouped by `topics` when we fill the input.
@@ -332,7 +503,7 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
         args.extend(list(abi_kwargs.items()))
         #print(args)
 
-        self._vars = OrderedDict(args)
+        self._vars = _VarsDict(args)
 
         self.set_structure(structure)
 
@@ -342,15 +513,52 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
             pseudos = [os.path.join(pseudo_dir, p) for p in list_strings(pseudos)]
 
         try:
-            self._pseudos = PseudoTable.as_table(pseudos).get_pseudos_for_structure(self.structure)
+            self._pseudos = _get_pseudos_for_structure(pseudos, self.structure)
         except ValueError as exc:
             raise self.Error(str(exc))
 
-        if comment is not None: self.set_comment(comment)
-
         self._decorators = [] if not decorators else decorators[:]
         self.tags = set() if not tags else set(tags)
 
+    def _fast_clone(self):
+        """
+        Return a new |AbinitInput| that shares the |Structure| and the |Pseudo| objects with self.
+        Only the variables, the list of pseudos, the decorators and the tags are copied so this method
+        is much faster than deepcopy. Used to generate several inputs from self.
+        Note that set_structure replaces the structure instead of changing it in place.
+        """
+        new = object.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        new._pseudos = list(self._pseudos)
+        new._vars = _VarsDict((k, _copy_var_value(v)) for k, v in self._vars.items())
+        new._decorators = self._decorators[:]
+        new.tags = set(self.tags)
+        return new
+
+    def __deepcopy__(self, memo):
+        """
+        Deepcopy of the input. Faster than the generic implementation because
+        the |Pseudo| objects, that are never changed in place, are shared.
+        The structure, the variables, the decorators and the list of pseudos are copied.
+        """
+        new = object.__new__(self.__class__)
+        memo[id(self)] = new
+        new.__dict__.update(self.__dict__)
+        new._structure = copy.deepcopy(self._structure, memo)
+        new._structure_abivars = None
+        new._pseudos = list(self._pseudos)
+        new._vars = _VarsDict((k, _copy_var_value(v, memo)) for k, v in self._vars.items())
+        new._decorators = copy.deepcopy(self._decorators, memo)
+        new.tags = set(self.tags)
+        return new
+
+    def __getstate__(self):
+        # The caches are recomputed on demand and are not pickled.
+        state = self.__dict__.copy()
+        state.pop("_pseudos_json_section", None)
+        state.pop("_structure_abivars", None)
+        return state
+
     def variable_checksum(self):
         """
         Return string with sha1 value in hexadecimal format.
@@ -406,9 +614,9 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
             abi_args.append((key, value))
 
         return dict(structure=self.structure.as_dict(),
-                    pseudos=[p.as_dict() for p in self.pseudos],
+                    pseudos=[_pseudo_as_dict(p) for p in self.pseudos],
                     comment=self.comment,
-                    decorators=[dec.as_dict() for dec in self.decorators],
+                    decorators=[dec.as_dict() if hasattr(dec, "as_dict") else dec for dec in self.decorators],
                     abi_args=abi_args,
                     tags=list(self.tags))
 
@@ -516,7 +724,10 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
         return self._decorators
 
     def register_decorator(self, decorator):
-        """Register a :class:`AbinitInputDecorator`."""
+        """
+        Register a :class:`AbinitInputDecorator`.
+        The object is stored as is, the conversion to dict is done in as_dict.
+        """
         self._decorators.append(decorator)
 
     def set_mnemonics(self, boolean):
@@ -526,10 +737,7 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
     @property
     def mnemonics(self):
         """Return True if mnemonics should be printed"""
-        try:
-            return self._mnemonics
-        except AttributeError:
-            return False
+        return self._mnemonics
 
     @property
     def uses_ktimereversal(self):
@@ -545,10 +753,7 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
     @property
     def spell_check(self):
         """True if spell checking is activated."""
-        try:
-            return self._spell_check
-        except AttributeError:  # TODO: This is to maintain compatibility with pickle
-            return False
+        return self._spell_check
 
     def to_string(self, sortmode="section", post=None, with_mnemonics=False, mode="text",
                   with_structure=True, with_pseudos=True, exclude=None, verbose=0):
@@ -599,13 +804,12 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
 
         if sortmode in (None, "a"):
             # Default is no sorting else alphabetical order.
-            keys = [k for k, v in self.items() if k not in exclude and v is not None]
-            if sortmode == "a": keys = sorted(keys)
+            items = ((k, v) for k, v in self._vars.items() if k not in exclude and v is not None)
+            if sortmode == "a": items = sorted(items, key=lambda t: t[0])
 
-            # Extract the items from the dict and add the geo variables at the end
-            items = [(k, self[k]) for k in keys]
+            # Add the geo variables at the end
             if with_structure:
-                items.extend(list(self.structure.to_abivars().items()))
+                items = itertools.chain(items, self._get_structure_abivars().items())
 
             for name, value in items:
                 if mnemonics and value is not None:
@@ -614,12 +818,12 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
                 # Build variable, convert to string and append it
                 vname = name + post
                 if mode == "html": vname = var_database[name].html_link(label=vname)
-                app(str(InputVariable(vname, value)))
+                app(_format_variable(vname, value))
 
         elif sortmode == "section":
             # Group variables by section.
             # Get dict mapping section_name --> list of variable names belonging to the section.
-            keys = [k for (k, v) in self.items() if k not in exclude and v is not None]
+            keys = [k for (k, v) in self._vars.items() if k not in exclude and v is not None]
             sec2names = var_database.group_by_varset(keys)
             w = 92
 
@@ -628,7 +832,7 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
                 app("#" + ("SECTION: %s" % sec).center(w - 1))
                 app(w * "#")
                 for name in names:
-                    value = self[name]
+                    value = self._vars[name]
                     if mnemonics and value is not None:
                         app(escape("# <" + var_database[name].mnemonics + ">"))
 
@@ -636,18 +840,18 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
                     vname = name + post
                     if mode == "html": vname = var_database[name].html_link(label=vname)
 
-                    app(str(InputVariable(vname, value)))
+                    app(_format_variable(vname, value))
 
             if with_structure:
                 app(w * "#")
                 app("#" + ("STRUCTURE").center(w - 1))
                 app(w * "#")
-                for name, value in self.structure.to_abivars().items():
+                for name, value in self._get_structure_abivars().items():
                     if mnemonics and value is not None:
                         app(escape("# <" + var_database[name].mnemonics + ">"))
                     vname = name + post
                     if mode == "html": vname = var_database[name].html_link(label=vname)
-                    app(str(InputVariable(vname, value)))
+                    app(_format_variable(vname, value))
 
         else:
             raise ValueError("Unsupported value for sortmode %s" % str(sortmode))
@@ -657,15 +861,23 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
             return s if mode != "html" else s.replace("\n", "<br>")
 
         # Add JSON section with pseudo potentials.
-        ppinfo = ["\n\n\n#<JSON>"]
-        d = {"pseudos": [p.as_dict() for p in self.pseudos]}
-        ppinfo.extend(json.dumps(d, indent=4).splitlines())
-        ppinfo.append("</JSON>")
-
-        s += escape("\n#".join(ppinfo))
+        s += escape(self._get_pseudos_json_section())
         if mode == "html": s = s.replace("\n", "<br>")
         return s
 
+    def _get_pseudos_json_section(self):
+        """
+        Return string with the JSON section with the pseudos added at the end of the input file.
+        The string is computed only once since the pseudos cannot be changed after the initialization.
+        """
+        section = getattr(self, "_pseudos_json_section", None)
+        if section is None:
+            d = {"pseudos": [_pseudo_as_dict(p) for p in self.pseudos]}
+            section = "\n\n\n#<JSON>\n#" + json.dumps(d, indent=4).replace("\n", "\n#") + "\n#</JSON>"
+            self._pseudos_json_section = section
+
+        return section
+
     def _repr_html_(self):
         """Integration with jupyter notebooks."""
         return self.to_string(sortmode="section", with_mnemonics=False, mode="html",
@@ -674,10 +886,7 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
     @property
     def comment(self):
         """Optional string with comment. None if comment is not set."""
-        try:
-            return self._comment
-        except AttributeError:
-            return None
+        return self._comment
 
     def set_comment(self, comment):
         """Set a comment to be included at the top of the file."""
@@ -688,13 +897,41 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
         """The |Structure| object associated to this input."""
         return self._structure
 
+    @property
+    def structure_abivars(self):
+        """
+        Dictionary with the ABINIT variables associated to the structure.
+        A new dictionary is returned so that callers can modify it without affecting the input.
+        """
+        abivars = self._get_structure_abivars()
+        return abivars.__class__((k, _copy_var_value(v)) for k, v in abivars.items())
+
+    def _get_structure_abivars(self):
+        """
+        Return the dictionary with the ABINIT variables associated to the structure.
+        The dictionary is cached and recomputed only if the structure has been changed.
+        Internal method: the dictionary and its values must not be changed.
+        """
+        s = self._structure
+        key = (id(s), _structure_key(s))
+        cache = getattr(self, "_structure_abivars", None)
+        if cache is None or cache[0] != key:
+            cache = (key, s.to_abivars())
+            self._structure_abivars = cache
+
+        return cache[1]
+
     def set_structure(self, structure):
         """Set structure."""
         self._structure = Structure.as_structure(structure)
-
-        # Check volume
-        m = self.structure.lattice.matrix
-        if np.dot(np.cross(m[0], m[1]), m[2]) <= 0:
+        self._structure_abivars = None
+
+        # Check volume. Scalar expression for the triple product because
+        # np.dot(np.cross(...)) is dominated by the numpy overhead for a 3x3 matrix.
+        a, b, c = self.structure.lattice.matrix.tolist()
+        vol = (a[0] * (b[1] * c[2] - b[2] * c[1]) - a[1] * (b[0] * c[2] - b[2] * c[0]) +
+               a[2] * (b[0] * c[1] - b[1] * c[0]))
+        if vol <= 0:
             raise self.Error("The triple product of the lattice vector is negative. Use structure.abi_sanitize.")
 
         return self._structure
@@ -709,8 +946,8 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
             shiftk: List of shifts.
             kptopt: Option for the generation of the mesh.
         """
-        shiftk = np.reshape(shiftk, (-1,3))
-        return self.set_vars(ngkpt=ngkpt, kptopt=kptopt, nshiftk=len(shiftk), shiftk=shiftk)
+        shiftk = _as_3col(shiftk)
+        return self._set_vars_unchecked(ngkpt=ngkpt, kptopt=kptopt, nshiftk=len(shiftk), shiftk=shiftk)
 
     def set_gamma_sampling(self):
         """Gamma-only sampling of the BZ."""
@@ -741,7 +978,7 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
         """
         # q-mesh for Fourier interpolatation of IFC and a2F(w)
         ph_ngqpt = self.structure.calc_ngkpt(nqsmall)
-        ph_qshift = np.reshape(ph_qshift, (-1, 3))
+        ph_qshift = _as_3col(ph_qshift)
 
         # TODO: Test default values of wstep and smear
         ph_intmeth = {"gaussian": 1, "tetra": 2}[method]
@@ -766,10 +1003,10 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
                 If None, we use the default high-symmetry k-path defined in the pymatgen database.
         """
         if kptbounds is None: kptbounds = self.structure.calc_kptbounds()
-        kptbounds = np.reshape(kptbounds, (-1,3))
+        kptbounds = _as_3col(kptbounds)
         #self.pop_vars(["ngkpt", "shiftk"]) ??
 
-        return self.set_vars(kptbounds=kptbounds, kptopt=-(len(kptbounds)-1), ndivsm=ndivsm, iscf=iscf)
+        return self._set_vars_unchecked(kptbounds=kptbounds, kptopt=-(len(kptbounds)-1), ndivsm=ndivsm, iscf=iscf)
 
     def set_qpath(self, ndivsm, qptbounds=None):
         """
@@ -782,7 +1019,7 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
                 If None, we use the default high-symmetry q-path defined in the pymatgen database.
         """
         if qptbounds is None: qptbounds = self.structure.calc_kptbounds()
-        qptbounds = np.reshape(qptbounds, (-1, 3))
+        qptbounds = _as_3col(qptbounds)
 
         return self.set_vars(ph_ndivsm=ndivsm, ph_nqpath=len(qptbounds), ph_qpath=qptbounds)
 
@@ -796,11 +1033,12 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
                 Accepts iterable that be reshaped to (nkptgw, 2)
                 or a tuple of two integers if the extrema are the same for each k-point.
         """
-        kptgw = np.reshape(kptgw, (-1,3))
+        kptgw = _as_3col(kptgw)
         nkptgw = len(kptgw)
         if len(bdgw) == 2: bdgw = len(kptgw) * bdgw
 
-        return self.set_vars(kptgw=kptgw, nkptgw=nkptgw, bdgw=np.reshape(bdgw, (nkptgw, 2)))
+        return self._set_vars_unchecked(kptgw=kptgw, nkptgw=nkptgw,
+                                        bdgw=np.asarray(bdgw, dtype=int).reshape(nkptgw, 2))
 
     def set_spin_mode(self, spin_mode):
         """
@@ -906,10 +1144,15 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
             num (int): Number of samples to generate. Default is 50.
             endpoint (bool): optional. If True, `stop` is the last sample. Otherwise, it is not included.
                 Default is True.
+
+        .. note::
+
+            The new inputs share the |Structure| object with self. Use ``set_structure``
+            to change the geometry of one input, do not modify the structure in place.
         """
         inps = []
         for value in np.linspace(start, stop, num=num, endpoint=endpoint, retstep=False):
-            inp = self.deepcopy()
+            inp = self._fast_clone()
             inp[varname] = value
             inps.append(inp)
 
@@ -932,10 +1175,15 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
             step: Spacing between values.  For any output `out`, this is the distance
                 between two adjacent values, ``out[i+1] - out[i]``.  The default
                 step size is 1.  If `step` is specified, `start` must also be given.
+
+        .. note::
+
+            The new inputs share the |Structure| object with self. Use ``set_structure``
+            to change the geometry of one input, do not modify the structure in place.
         """
         inps = []
         for value in np.arange(start=start, stop=stop, step=step):
-            inp = self.deepcopy()
+            inp = self._fast_clone()
             inp[varname] = value
             inps.append(inp)
 
@@ -948,6 +1196,11 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
         .. code-block:: python
 
             inp.product("ngkpt", "tsmear", [[2,2,2], [4,4,4]], [0.1, 0.2, 0.3])
+
+        .. note::
+
+            The new inputs share the |Structure| object with self. Use ``set_structure``
+            to change the geometry of one input, do not modify the structure in place.
         """
         # Split items into varnames and values
         for i, item in enumerate(items):
@@ -962,14 +1215,11 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
         #varnames = [t[0] for t in items]
         #values = [t[1] for t in items]
 
-        varnames = [ [varnames[i]] * len(values[i]) for i in range(len(values))]
-        varnames = itertools.product(*varnames)
-        values = itertools.product(*values)
-
+        # Only the values must be combined, the names are fixed.
         inps = []
-        for names, values in zip(varnames, values):
-            inp = self.deepcopy()
-            inp.set_vars(**{k: v for k, v in zip(names, values)})
+        for combo in itertools.product(*values):
+            inp = self._fast_clone()
+            inp.set_vars(**dict(zip(varnames, combo)))
             inps.append(inp)
 
         return inps
@@ -1097,13 +1347,18 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
         """
         This function receives a list of :class:`AbinitInputDecorator` objects or just a single object,
         applies the decorators to the input and returns a new |AbinitInput| object. self is not changed.
+
+        .. note::
+
+            The new input shares the |Structure| object with self. Use ``set_structure``
+            to change its geometry, do not modify the structure in place.
         """
         if not isinstance(decorators, (list, tuple)): decorators = [decorators]
 
-        # Deepcopy only at the first step to improve performance.
-        inp = self
-        for i, dec in enumerate(decorators):
-            inp = dec(inp, deepcopy=(i == 0))
+        # Copy only at the first step to improve performance.
+        inp = self._fast_clone()
+        for dec in decorators:
+            inp = dec(inp, deepcopy=False)
 
         return inp
 
@@ -1553,7 +1808,7 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
 
         if ngkpt is not None: inp["ngkpt"] = ngkpt
         if shiftk is not None:
-            shiftk = np.reshape(shiftk, (-1, 3))
+            shiftk = _as_3col(shiftk)
             inp.set_vars(shiftk=shiftk, nshiftk=len(shiftk))
 
         if kptopt is not None: inp["kptopt"] = kptopt
@@ -1651,7 +1906,7 @@ class AbinitInput(six.with_metaclass(abc.ABCMeta, AbstractInput, MSONable, Has_S
 
         if ngkpt is not None: inp["ngkpt"] = ngkpt
         if shiftk is not None:
-            shiftk = np.reshape(shiftk, (-1,3))
+            shiftk = _as_3col(shiftk)
             inp.set_vars(shiftk=shiftk, nshiftk=len(inp['shiftk']))
 
         inp.set_vars(
@@ -1919,11 +2174,20 @@ class MultiDataset(object):
     """
     Error = AbinitInputError
 
+    # Used to cache the value of has_same_structures.
+    _struct_cache_token = None
+
+    # Cache used in __getattr__. Maps method name --> (attrgetter, True).
+    _dispatch_cache = {}
+
     @classmethod
     def from_inputs(cls, inputs):
         """Build object from a list of |AbinitInput| objects."""
+        # Identity test first since the inputs usually share the same list of pseudos e.g. after product.
+        # tuple.__eq__ compares the items by identity before calling Pseudo.__eq__.
+        base = inputs[0].pseudos
         for inp in inputs:
-            if any(p1 != p2 for p1, p2 in zip(inputs[0].pseudos, inp.pseudos)):
+            if inp.pseudos is not base and tuple(inp.pseudos) != tuple(base):
                 raise ValueError("Pseudos must be consistent when from_inputs is invoked.")
 
         # Build MultiDataset from input structures and pseudos and add inputs.
@@ -1931,8 +2195,8 @@ class MultiDataset(object):
 
         # Add variables, decorators and tags.
         for inp, new_inp in zip(inputs, multi):
-            new_inp.set_vars(**inp)
-            new_inp._decorators = inp.decorators
+            new_inp._set_vars_unchecked(inp.vars)
+            new_inp._decorators = inp.decorators[:]
             new_inp.tags = set(inp.tags)
 
         return multi
@@ -1943,7 +2207,7 @@ class MultiDataset(object):
         multi = cls(input.structure, input.pseudos, ndtset=ndtset)
 
         for inp in multi:
-            inp.set_vars({k: v for k, v in input.items()})
+            inp._set_vars_unchecked(input.vars)
             inp.tags = set(input.tags)
 
         return multi
@@ -1959,8 +2223,9 @@ class MultiDataset(object):
             ndtset: Number of datasets.
         """
         # Setup of the pseudopotential files.
+        # Build the table here so that the AbinitInput objects can reuse it.
         if isinstance(pseudos, Pseudo):
-            pseudos = [pseudos]
+            pseudos = PseudoTable([pseudos])
 
         elif isinstance(pseudos, PseudoTable):
             pseudos = pseudos
@@ -2026,17 +2291,31 @@ class MultiDataset(object):
     def __getattr__(self, name):
         #print("in getname with name: %s" % name)
         #m = getattr(self._inputs[0], name)
+        # Only the public API of AbinitInput is forwarded to the inputs. In particular, special methods
+        # (e.g. __getstate__ requested by pickle) must not be forwarded nor stored in _dispatch_cache.
+        if name.startswith("_"):
+            raise AttributeError("%s object has no attribute %s" % (self.__class__.__name__, name))
+
         _inputs = object.__getattribute__(self, "_inputs")
-        m = getattr(_inputs[0], name)
-        if m is None:
-            raise AttributeError("Cannot find attribute %s. Tried in %s and then in AbinitInput object"
-                                 % (self.__class__.__name__, name))
-        isattr = not callable(m)
+
+        # The names of the methods of AbinitInput are cached so that
+        # we don't need to probe the first input at each call.
+        entry = MultiDataset._dispatch_cache.get(name)
+        if entry is None:
+            m = getattr(_inputs[0], name)
+            if m is None:
+                raise AttributeError("Cannot find attribute %s. Tried in %s and then in AbinitInput object"
+                                     % (self.__class__.__name__, name))
+            entry = (operator.attrgetter(name), callable(m))
+            # Don't cache attributes since their value may become None.
+            if entry[1]: MultiDataset._dispatch_cache[name] = entry
+
+        getter, is_method = entry
 
         def on_all(*args, **kwargs):
             results = []
-            for obj in self._inputs:
-                a = getattr(obj, name)
+            for obj in _inputs:
+                a = getter(obj)
                 #print("name", name, ", type:", type(a), "callable: ",callable(a))
                 if callable(a):
                     results.append(a(*args, **kwargs))
@@ -2045,8 +2324,7 @@ class MultiDataset(object):
 
             return results
 
-        if isattr: on_all = on_all()
-        return on_all
+        return on_all if is_method else on_all()
 
     def __add__(self, other):
         """self + other"""
@@ -2074,21 +2352,35 @@ class MultiDataset(object):
     def append(self, abinit_input):
         """Add a |AbinitInput| to the list."""
         assert isinstance(abinit_input, AbinitInput)
-        if any(p1 != p2 for p1, p2 in zip(abinit_input.pseudos, abinit_input.pseudos)):
+        base = self[0].pseudos
+        if abinit_input.pseudos is not base and tuple(abinit_input.pseudos) != tuple(base):
             raise ValueError("Pseudos must be consistent when from_inputs is invoked.")
         self._inputs.append(abinit_input)
+        self._struct_cache_token = None
 
     def extend(self, abinit_inputs):
         """Extends self with a list of |AbinitInput| objects."""
-        assert all(isinstance(inp, AbinitInput) for inp in abinit_inputs)
+        # Build the list once so that generators are supported and the inputs are validated in a single pass.
+        abinit_inputs = list(abinit_inputs)
+        base = self[0].pseudos
         for inp in abinit_inputs:
-            if any(p1 != p2 for p1, p2 in zip(self[0].pseudos, inp.pseudos)):
+            assert isinstance(inp, AbinitInput)
+            if inp.pseudos is not base and tuple(inp.pseudos) != tuple(base):
                 raise ValueError("Pseudos must be consistent when from_inputs is invoked.")
+        self._extend_unchecked(abinit_inputs)
+
+    def _extend_unchecked(self, abinit_inputs):
+        """
+        Extends self with a list of |AbinitInput| objects without validating them.
+        Used internally when the inputs are known to be consistent with self.
+        """
         self._inputs.extend(abinit_inputs)
+        self._struct_cache_token = None
 
     def addnew_from(self, dtindex):
         """Add a new entry in the multidataset by copying the input with index ``dtindex``."""
-        self.append(self[dtindex].deepcopy())
+        # The copy has the same Pseudo objects as self[dtindex] hence there's no need to check them.
+        self._extend_unchecked([self[dtindex].deepcopy()])
 
     def split_datasets(self):
         """Return list of |AbinitInput| objects.."""
@@ -2098,10 +2390,38 @@ class MultiDataset(object):
         """Deep copy of the MultiDataset."""
         return copy.deepcopy(self)
 
+    def __deepcopy__(self, memo):
+        """
+        Deepcopy of the MultiDataset. The memo dictionary is passed to the inputs
+        so that structures shared by the original inputs are still shared in the copy.
+        """
+        new = object.__new__(self.__class__)
+        memo[id(self)] = new
+        new.__dict__.update(self.__dict__)
+        new._inputs = [copy.deepcopy(inp, memo) for inp in self._inputs]
+        new._struct_cache_token = None
+        return new
+
     @property
     def has_same_structures(self):
-        """True if all inputs in MultiDataset are equal."""
-        return all(self[0].structure == inp.structure for inp in self)
+        """True if all inputs in MultiDataset have the same structure."""
+        structures = [inp.structure for inp in self]
+        s0 = structures[0]
+        # Fast path: the inputs share the same object (e.g. replicate_input).
+        if all(s is s0 for s in structures): return True
+
+        # Structure.__eq__ is expensive so we cache the result.
+        # The cache is invalidated if the list of structures changes or if
+        # one of the structures has been modified in place (e.g. perturb).
+        keys = [_structure_key(s) for s in structures]
+        token = self._struct_cache_token
+        if (token is not None and len(token[0]) == len(structures) and
+            all(s1 is s2 for s1, s2 in zip(token[0], structures)) and token[1] == keys):
+            return token[2]
+
+        same = all(s0 == s for s in structures)
+        self._struct_cache_token = (structures, keys, same)
+        return same
 
     def __str__(self):
         return self.to_string()
@@ -2147,7 +2467,7 @@ class MultiDataset(object):
                 lines.append(w * "#")
                 for key in global_vars:
                     vname = key if mode == "text" else var_database[key].html_link(label=key)
-                    lines.append(str(InputVariable(vname, self[0][key])))
+                    lines.append(_format_variable(vname, self[0][key]))
 
             has_same_structures = self.has_same_structures
             if has_same_structures:
@@ -2155,18 +2475,18 @@ class MultiDataset(object):
                 lines.append(w * "#")
                 lines.append("#" + ("STRUCTURE").center(w - 1))
                 lines.append(w * "#")
-                for key, value in self[0].structure.to_abivars().items():
+                for key, value in self[0]._get_structure_abivars().items():
                     vname = key if mode == "text" else var_database[key].html_link(label=key)
-                    lines.append(str(InputVariable(vname, value)))
+                    lines.append(_format_variable(vname, value))
 
+            ntab = len(_DS_POST)
             for i, inp in enumerate(self):
-                header = "### DATASET %d ###" % (i + 1)
                 is_last = (i==self.ndtset - 1)
-                s = inp.to_string(post=str(i + 1), with_pseudos=is_last and with_pseudos, mode=mode,
+                post = _DS_POST[i] if i < ntab else str(i + 1)
+                s = inp.to_string(post=post, with_pseudos=is_last and with_pseudos, mode=mode,
                                   with_structure=not has_same_structures, exclude=global_vars)
                 if s:
-                    header = len(header) * "#" + "\n" + header + "\n" + len(header) * "#" + "\n"
-                    s = "\n" + header + s + "\n"
+                    s = (_DS_BANNER[i] if i < ntab else _dataset_banner(i + 1)) + s + "\n"
 
                 lines.append(s)
 
@@ -2266,6 +2586,59 @@ class MultiDataset(object):
 
         return MultiDataset.from_inputs(inputs) if inputs else None
 
+    def _map_inputs(self, func, num_cpus=None):
+        """
+        Call ``func(inp)`` for each input in self and return the list of results.
+        Since ``func`` usually executes Abinit in a subprocess, the calls are distributed
+        among ``num_cpus`` threads. Use num_cpus=1 for the sequential version. Autodetected if None.
+        """
+        num_cpus = get_ncpus() // 2 if num_cpus is None else num_cpus
+        num_cpus = max(1, min(num_cpus, self.ndtset))
+        if num_cpus == 1:
+            return [func(inp) for inp in self]
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(processes=num_cpus)
+        try:
+            return pool.map(func, self._inputs)
+        finally:
+            pool.close()
+            pool.join()
+
+    def abivalidate_all(self, num_cpus=None, manager=None):
+        """
+        Run ABINIT in dry-run mode to validate all the inputs in self.
+        The calls are independent and are executed in parallel using threads.
+
+        Args:
+            num_cpus: Number of threads. Autodetected if None.
+            manager: |TaskManager| of the task. If None, the manager is initialized from the config file.
+
+        Return:
+            List with the `namedtuple` returned by |AbinitInput| abivalidate for each dataset.
+        """
+        from abipy.flowtk import TaskManager
+        manager = TaskManager.as_manager(manager)
+        return self._map_inputs(lambda inp: inp.abivalidate(manager=manager), num_cpus=num_cpus)
+
+    def abiget_ibz_all(self, ngkpt=None, shiftk=None, kptopt=None, num_cpus=None, manager=None):
+        """
+        Compute the list of points in the IBZ and the corresponding weights for all the inputs in self.
+        The calls are independent and are executed in parallel using threads.
+
+        Args:
+            ngkpt, shiftk, kptopt: See |AbinitInput| abiget_ibz.
+            num_cpus: Number of threads. Autodetected if None.
+            manager: |TaskManager| of the task. If None, the manager is initialized from the config file.
+
+        Return:
+            List with the `namedtuple` returned by |AbinitInput| abiget_ibz for each dataset.
+        """
+        from abipy.flowtk import TaskManager
+        manager = TaskManager.as_manager(manager)
+        return self._map_inputs(lambda inp: inp.abiget_ibz(ngkpt=ngkpt, shiftk=shiftk, kptopt=kptopt,
+                                                           manager=manager), num_cpus=num_cpus)
+
     def write(self, filepath="run.abi"):
         """
         Write ``ndset`` input files to disk. The name of the file
@@ -2292,6 +2665,10 @@ class AnaddbInput(AbstractInput, Has_Structure):
 
     Error = AnaddbInputError
 
+    # Default values. Class attributes so that objects unpickled from older versions still work.
+    _spell_check = False
+    _fmt_cache = None
+
     def __init__(self, structure, comment="", anaddb_args=None, anaddb_kwargs=None):
         """
         Args:
@@ -2315,12 +2692,28 @@ class AnaddbInput(AbstractInput, Has_Structure):
         args = list(anaddb_args)[:]
         args.extend(list(anaddb_kwargs.items()))
 
-        self._vars = OrderedDict(args)
+        self._vars = _VarsDict(args)
 
     @property
     def vars(self):
         return self._vars
 
+    def __deepcopy__(self, memo):
+        """Deepcopy of the input. Faster than the generic implementation."""
+        new = object.__new__(self.__class__)
+        memo[id(self)] = new
+        new.__dict__.update(self.__dict__)
+        new._structure = copy.deepcopy(self._structure, memo)
+        new._vars = self._vars.__class__((k, _copy_var_value(v, memo)) for k, v in self._vars.items())
+        new._fmt_cache = None
+        return new
+
+    def __getstate__(self):
+        # The cache with the formatted variables is not pickled.
+        state = self.__dict__.copy()
+        state.pop("_fmt_cache", None)
+        return state
+
     def set_spell_check(self, false_or_true):
         """Activate/Deactivate spell-checking"""
         self._spell_check = bool(false_or_true)
@@ -2328,10 +2721,7 @@ class AnaddbInput(AbstractInput, Has_Structure):
     @property
     def spell_check(self):
         """True if spell checking is activated."""
-        try:
-            return self._spell_check
-        except AttributeError: # This is to maintain compatibility with pickle
-            return False
+        return self._spell_check
 
     def _check_varname(self, key):
         if not is_anaddb_var(key) and self.spell_check:
@@ -2369,7 +2759,7 @@ class AnaddbInput(AbstractInput, Has_Structure):
             #print(type(qpoint), qpoint.shape)
             raise ValueError("Wrong q-point %s" % qpoint)
 
-        new.set_vars(
+        new._set_vars_unchecked(
             ifcflag=ifcflag,        # Interatomic force constant flag
             asr=asr,                # Acoustic Sum Rule
             chneut=chneut,          # Charge neutrality requirement for effective charges.
@@ -2386,7 +2776,7 @@ class AnaddbInput(AbstractInput, Has_Structure):
             # append 0 to specify that these are directions,
             directions = np.c_[directions, np.zeros(len(directions))]
             # add
-            new.set_vars(
+            new._set_vars_unchecked(
                 nph2l=len(directions),
                 qph2l=directions
             )
@@ -2404,7 +2794,7 @@ class AnaddbInput(AbstractInput, Has_Structure):
         else:
             elaflag = 3
 
-        new.set_vars(
+        new._set_vars_unchecked(
             elaflag=elaflag,
             piezoflag=3,
             instrflag=1,
@@ -2457,7 +2847,7 @@ class AnaddbInput(AbstractInput, Has_Structure):
 
         # Parameters for the dos.
         new.set_autoqmesh(nqsmall)
-        new.set_vars(prtdos=prtdos, dosdeltae=dosdeltae, dossmear=dossmear)
+        new._set_vars_unchecked(prtdos=prtdos, dosdeltae=dosdeltae, dossmear=dossmear)
 
         # Disable DOS computation.
         if nqsmall == 0:
@@ -2465,9 +2855,9 @@ class AnaddbInput(AbstractInput, Has_Structure):
 
         new.set_qpath(ndivsm, qptbounds=qptbounds)
         qptbounds = new['qpath']
-        q1shft = np.reshape(q1shft, (-1, 3))
+        q1shft = _as_3col(q1shft)
 
-        new.set_vars(
+        new._set_vars_unchecked(
             ifcflag=1,
             ngqpt=np.array(ngqpt),
             q1shft=q1shft,
@@ -2492,7 +2882,7 @@ class AnaddbInput(AbstractInput, Has_Structure):
 
             if directions:
                 directions = np.reshape(directions, (-1, 4))
-                new.set_vars(
+                new._set_vars_unchecked(
                     nph2l=len(directions),
                     qph2l=directions
                 )
@@ -2557,9 +2947,9 @@ class AnaddbInput(AbstractInput, Has_Structure):
                   anaddb_args=anaddb_args, anaddb_kwargs=anaddb_kwargs)
         new.set_autoqmesh(nqsmall)
 
-        q1shft = np.reshape(q1shft, (-1, 3))
+        q1shft = _as_3col(q1shft)
 
-        new.set_vars(
+        new._set_vars_unchecked(
             ifcflag=1,
             thmflag=1,
             ngqpt=np.array(ngqpt),
@@ -2617,7 +3007,7 @@ class AnaddbInput(AbstractInput, Has_Structure):
         """
         new = cls(structure, comment="ANADB input for modes", anaddb_args=anaddb_args, anaddb_kwargs=anaddb_kwargs)
 
-        new.set_vars(
+        new._set_vars_unchecked(
             enunit=enunit,
             eivec=1,
             ifcflag=1,
@@ -2652,13 +3042,13 @@ class AnaddbInput(AbstractInput, Has_Structure):
         new = cls(structure, comment="ANADB input for IFC",
                   anaddb_args=anaddb_args, anaddb_kwargs=anaddb_kwargs)
 
-        q1shft = np.reshape(q1shft, (-1, 3))
+        q1shft = _as_3col(q1shft)
 
         #TODO add in anaddb an option to get all the atoms if ifcout<0
         # Huge number abinit will limit to the big box
         ifcout = ifcout or 10000000
 
-        new.set_vars(
+        new._set_vars_unchecked(
             ifcflag=1,
             ngqpt=np.array(ngqpt),
             q1shft=q1shft,
@@ -2688,30 +3078,53 @@ class AnaddbInput(AbstractInput, Has_Structure):
             sortmode: "a" for alphabetical order, None if no sorting is wanted
             mode: Either `text` or `html` if HTML output with links is wanted.
         """
-        lines = []
-        app = lines.append
-
-        if self.comment:
-            app("# " + self.comment.replace("\n", "\n#"))
-
         if sortmode is None:
             # no sorting.
-            keys = self.keys()
+            items = self._vars.items()
         elif sortmode == "a":
             # alphabetical order.
-            keys = sorted(self.keys())
+            items = sorted(self._vars.items(), key=lambda t: t[0])
         else:
             raise ValueError("Unsupported value for sortmode %s" % str(sortmode))
 
-        # https://www.abinit.org/doc/helpfiles/for-v8.4/users/anaddb_help.html#mustar
-        root = "https://www.abinit.org/doc/helpfiles/for-v8.4/users/anaddb_help.html"
-        for varname in keys:
-            value = self[varname]
-            if mode == "html": varname = root + "#%s" % varname
-            app(str(InputVariable(varname, value)))
+        format_var = self._format_var
+        if mode == "text":
+            lines = [format_var(varname, value) for varname, value in items]
+        else:
+            # https://www.abinit.org/doc/helpfiles/for-v8.4/users/anaddb_help.html#mustar
+            root = "https://www.abinit.org/doc/helpfiles/for-v8.4/users/anaddb_help.html#"
+            lines = [format_var(root + varname, value) for varname, value in items]
+
+        if self.comment:
+            lines.insert(0, "# " + self.comment.replace("\n", "\n#"))
 
         return "\n".join(lines) if mode == "text" else "\n".join(lines).replace("\n", "<br>")
 
+    def _format_var(self, varname, value):
+        """
+        Return the string with the declaration of the variable in the input file.
+        The strings of ndarray values are cached and reused as long as the variable
+        is associated to the same array with the same shape, dtype and content
+        so that in-place modifications of the array are detected.
+        """
+        if not isinstance(value, np.ndarray) or value.dtype == object:
+            return _format_variable(varname, value)
+
+        cache = self._fmt_cache
+        if cache is None:
+            cache = self._fmt_cache = {}
+
+        data = value.tobytes()
+        entry = cache.get(varname)
+        if entry is not None and entry[0] is value and entry[1] == (value.shape, value.dtype) and entry[2] == data:
+            return entry[3]
+
+        s = _format_variable(varname, value)
+        # Entries of variables that have been removed are not invalidated explicitly.
+        if len(cache) >= 4 * len(self._vars): cache.clear()
+        cache[varname] = (value, (value.shape, value.dtype), data, s)
+        return s
+
     def _repr_html_(self):
         """Integration with jupyter_ notebooks."""
         return self.to_string(mode="html")
@@ -2726,9 +3139,9 @@ class AnaddbInput(AbstractInput, Has_Structure):
                 If None, we use the default high-symmetry k-path defined in the pymatgen database.
         """
         if qptbounds is None: qptbounds = self.structure.calc_kptbounds()
-        qptbounds = np.reshape(qptbounds, (-1, 3))
+        qptbounds = _as_3col(qptbounds)
 
-        return self.set_vars(ndivsm=ndivsm, nqpath=len(qptbounds), qpath=qptbounds)
+        return self._set_vars_unchecked(ndivsm=ndivsm, nqpath=len(qptbounds), qpath=qptbounds)
 
     def set_autoqmesh(self, nqsmall):
         """
@@ -2737,7 +3150,7 @@ class AnaddbInput(AbstractInput, Has_Structure):
         Args:
             nqsmall: Number of divisions used to sample the smallest lattice vector.
         """
-        return self.set_vars(ng2qpt=self.structure.calc_ngkpt(nqsmall))
+        return self._set_vars_unchecked(ng2qpt=self.structure.calc_ngkpt(nqsmall))
 
     def abivalidate(self, workdir=None, manager=None):
         """
@@ -8,7 +8,21 @@ import abipy.data as abidata
 from pymatgen.core.units import bohr_to_ang
 from abipy.core.structure import *
 from abipy.core.testing import AbipyTest
-from abipy.abio.abivars import AbinitInputFile, AbinitInputParser
+from abipy.abio.abivars import AbinitInputFile, AbinitInputParser, is_abivar, is_anaddb_var
+
+
+class TestAbinitVariables(AbipyTest):
+
+    def test_is_abivar(self):
+        """Testing is_abivar."""
+        assert is_abivar("ecut") and is_abivar("ngkpt")
+        assert is_abivar("include") and is_abivar("xyzfile")
+        assert not is_abivar("foobar")
+
+    def test_is_anaddb_var(self):
+        """Testing is_anaddb_var."""
+        assert is_anaddb_var("asr") and is_anaddb_var("ifcflag")
+        assert not is_anaddb_var("foobar")
 
 
 class TestAbinitInputParser(AbipyTest):
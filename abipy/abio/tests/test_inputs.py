@@ -2,6 +2,7 @@
 from __future__ import print_function, division, unicode_literals
 
 import os
+import pickle
 import numpy as np
 import abipy.data as abidata
 
@@ -44,6 +45,14 @@ class TestAbinitInput(AbipyTest):
         assert inp.isnc and not inp.ispaw
         assert not inp.decorators
         assert len(inp.structure) == 2 and inp.num_valence_electrons == 8
+        assert inp.structure_abivars["natom"] == 2
+        # structure_abivars returns a copy of the cached dictionary.
+        abivars = inp.structure_abivars
+        assert abivars is not inp.structure_abivars
+        abivars["natom"] = 3
+        abivars["xred"][0, 0] += 0.1
+        assert inp.structure_abivars["natom"] == 2
+        self.assert_equal(inp.structure_abivars["xred"], inp.structure.frac_coords)
 
         # foo is not a valid Abinit variable
         with self.assertRaises(inp.Error):
@@ -82,6 +91,13 @@ class TestAbinitInput(AbipyTest):
         inp.set_vars_ifnotin(ecut=-10)
         assert inp["ecut"] == 5
         assert inp.scf_tolvar == ("toldfe", inp["toldfe"])
+        d = {"ecut": 6, "nband": 12}
+        assert inp.update_vars(d) is d
+        assert inp["ecut"] == 6 and inp["nband"] == 12
+        inp.set_vars({"ecut": 5}, nband=10)
+        assert inp["ecut"] == 5 and inp["nband"] == 10
+        with self.assertRaises(inp.Error):
+            inp.update_vars({"foobar": 1})
 
         inp.write(filepath=self.get_tmpname(text=True))
 
@@ -101,6 +117,10 @@ class TestAbinitInput(AbipyTest):
         inp_copy = inp.deepcopy()
         inp_copy["bdgw"][1] = 3
         assert inp["bdgw"] == [1, 2]
+        assert inp_copy.structure == inp.structure and inp_copy.structure is not inp.structure
+        assert inp_copy.pseudos == inp.pseudos
+        inp_copy.pseudos.append(inp.pseudos[0])
+        assert len(inp_copy.pseudos) == len(inp.pseudos) + 1
         assert inp.remove_vars("bdgw") and "bdgw" not in inp
 
         removed = inp.pop_tolerances()
@@ -121,6 +141,11 @@ class TestAbinitInput(AbipyTest):
         # Compatible with Pickle and MSONable?
         self.serialize_with_pickle(inp, test_eq=False)
         self.assertMSONable(inp)
+        # The JSON section with the pseudos is cached but not pickled.
+        assert inp.to_string()
+        assert "_pseudos_json_section" in inp.__dict__
+        assert "_pseudos_json_section" not in inp.__getstate__()
+        assert "_structure_abivars" not in inp.__getstate__()
 
         # Test generate method.
         ecut_list = [10, 20]
@@ -163,6 +188,13 @@ class TestAbinitInput(AbipyTest):
             s = abidata.structure_from_ucell("Al-negative-volume")
             AbinitInput(s, pseudos=abidata.pseudos("13al.981214.fhi"))
 
+        # Variables defining the structure cannot be set directly.
+        inp = AbinitInput(si_structure, pseudos=abidata.pseudos("14si.pspnc"))
+        for varname in ("acell", "rprimd", "angdeg", "xcart", "xangst"):
+            assert varname in GEOVARS
+            with self.assertRaises(AbinitInput.Error):
+                inp[varname] = 1
+
     def test_helper_functions(self):
         """Testing AbinitInput helper functions."""
         pseudo = abidata.pseudo("14si.pspnc")
@@ -180,6 +212,11 @@ class TestAbinitInput(AbipyTest):
         inp.set_gamma_sampling()
         assert inp["kptopt"] == 1 and inp["nshiftk"] == 1
         assert np.all(inp["shiftk"] == 0)
+        # Integer shifts must be written as integers.
+        assert inp["shiftk"].dtype.kind == "i"
+        assert " shiftk 0 0 0" in inp.to_string(sortmode="a")
+        with self.assertRaises((TypeError, ValueError)):
+            inp.set_kmesh(ngkpt=(1, 2, 3), shiftk=[[0, 0, 0], [0.5, 0.5]])
 
         inp.set_autokmesh(nksmall=2)
         assert inp["kptopt"] == 1 and np.all(inp["ngkpt"] == [2, 2, 2]) and inp["nshiftk"] == 4
@@ -209,6 +246,11 @@ class TestAbinitInput(AbipyTest):
         assert len(prod_inps) == 6
         assert prod_inps[0]["ngkpt"] == [2, 2, 2] and prod_inps[0]["tsmear"] == 0.1
         assert prod_inps[-1]["ngkpt"] ==  [4, 4, 4] and prod_inps[-1]["tsmear"] == 0.3
+        # The new inputs share structure and pseudos with inp but not the variables.
+        assert prod_inps[0].structure is inp.structure and prod_inps[0].pseudos == inp.pseudos
+        assert prod_inps[0].pseudos is not inp.pseudos
+        prod_inps[0]["kptgw"][0, 0] = 100
+        assert inp["kptgw"][0, 0] != 100
 
         inp["kptopt"] = 4
         assert not inp.uses_ktimereversal
@@ -292,6 +334,14 @@ class TestAbinitInput(AbipyTest):
         assert np.all(ibz.points == [[ 0.,  0.,  0.], [0.5,  0.,  0.], [0.5, 0.5, 0.]])
         assert np.all(ibz.weights == [0.125,  0.5,  0.375])
 
+        # Test abiget_ibz_all
+        multi = MultiDataset.from_inputs([inp_si, inp_si.deepcopy()])
+        multi[1].set_kmesh(ngkpt=(1, 1, 1), shiftk=(0, 0, 0))
+        ibz_all = multi.abiget_ibz_all(num_cpus=2)
+        assert len(ibz_all) == 2
+        assert np.all(ibz_all[0].points == ibz.points) and np.all(ibz_all[0].weights == ibz.weights)
+        assert np.all(ibz_all[1].points == [[0., 0., 0.]])
+
         # This to test what happes with wrong inputs and Abinit errors.
         wrong = inp_si.deepcopy()
         removed = wrong.pop_vars("ecut")
@@ -335,6 +385,9 @@ class TestAbinitInput(AbipyTest):
         #self.assertIsInstance(inp_dict['abi_kwargs'], collections.OrderedDict)
         assert "abi_args" in inp_dict and len(inp_dict["abi_args"]) == len(inp)
         assert all(k in inp for k, _ in inp_dict["abi_args"])
+        assert inp_dict["pseudos"] == [p.as_dict() for p in inp.pseudos]
+        invalidate_pseudo_cache()
+        assert inp.as_dict()["pseudos"] == inp_dict["pseudos"]
         self.assertMSONable(inp)
 
     def test_dfpt_methods(self):
@@ -381,6 +434,8 @@ class TestAbinitInput(AbipyTest):
 
         # Validate with Abinit
         self.abivalidate_multi(phg_inputs)
+        # Same calls executed with threads.
+        assert all(v.retcode == 0 for v in phg_inputs.abivalidate_all(num_cpus=2))
 
         ##############
         # BEC methods
@@ -474,11 +529,43 @@ class TestAbinitInput(AbipyTest):
 class TestMultiDataset(AbipyTest):
     """Unit tests for MultiDataset."""
 
+    def test_map_inputs(self):
+        """Testing MultiDataset._map_inputs."""
+        multi = MultiDataset(structure=abidata.cif_file("si.cif"), pseudos=abidata.pseudos("14si.pspnc"), ndtset=5)
+        for i, inp in enumerate(multi):
+            inp["ecut"] = i + 1
+
+        # The order of the results must be preserved in the sequential and in the threaded version.
+        for num_cpus in (None, 1, 2, 10):
+            assert multi._map_inputs(lambda inp: inp["ecut"], num_cpus=num_cpus) == [1, 2, 3, 4, 5]
+
+        # Exceptions raised by func are propagated.
+        def func(inp):
+            if inp["ecut"] == 3: raise ValueError("ecut")
+            return inp["ecut"]
+
+        for num_cpus in (1, 2):
+            with self.assertRaises(ValueError):
+                multi._map_inputs(func, num_cpus=num_cpus)
+
     def test_api(self):
         """Testing MultiDataset API."""
         structure = abilab.Structure.from_file(abidata.cif_file("si.cif"))
         pseudo = abidata.pseudo("14si.pspnc")
         pseudo_dir = os.path.dirname(pseudo.filepath)
+        multi = MultiDataset(structure=structure, pseudos=pseudo, ndtset=2)
+        # The Pseudo objects are shared but each input has its own list.
+        assert multi[0].pseudos is not multi[1].pseudos
+        assert all(p1 is p2 for p1, p2 in zip(multi[0].pseudos, multi[1].pseudos))
+        multi[1].pseudos.append(pseudo)
+        assert len(multi[0].pseudos) == 1
+        # from_inputs builds a new table with the same pseudos: the cached entry must be reused.
+        from abipy.abio.inputs import _PSEUDOS_FOR_STRUCTURE_CACHE
+        ncache = len(_PSEUDOS_FOR_STRUCTURE_CACHE)
+        for i in range(2):
+            assert MultiDataset.from_inputs(multi[:1])[0].pseudos == multi[0].pseudos
+        assert len(_PSEUDOS_FOR_STRUCTURE_CACHE) == ncache
+
         multi = MultiDataset(structure=structure, pseudos=pseudo)
         with self.assertRaises(ValueError):
             MultiDataset(structure=structure, pseudos=pseudo, ndtset=-1)
@@ -494,6 +581,12 @@ class TestMultiDataset(AbipyTest):
         assert multi.ndtset == 2 and multi[0] is not multi[1]
         assert multi[0].structure ==  multi[1].structure
         assert multi[0].structure is not multi[1].structure
+        assert multi[0].pseudos == multi[1].pseudos and multi[0].pseudos is not multi[1].pseudos
+
+        # extend accepts generators.
+        new_multi = MultiDataset.from_inputs([multi[0]])
+        new_multi.extend(inp.deepcopy() for inp in multi)
+        assert new_multi.ndtset == 3
 
         multi.set_vars(ecut=2)
         assert all(inp["ecut"] == 2 for inp in multi)
@@ -523,6 +616,17 @@ class TestMultiDataset(AbipyTest):
         multi[1].set_structure(pert_structure)
         assert multi[0].structure != multi[1].structure and multi[1].structure == pert_structure
         assert not multi.has_same_structures
+        # Cached value must be updated if a structure is replaced.
+        multi[1].set_structure(structure.copy())
+        assert multi.has_same_structures
+        # or if a structure is changed in place.
+        multi[1].structure.perturb(distance=0.1)
+        assert not multi.has_same_structures
+        # Each dataset must have its own geometry.
+        s = multi.to_string()
+        assert " xred1" in s and " xred2" in s
+        multi[1].set_structure(structure.copy())
+        assert multi.has_same_structures
 
         split = multi.split_datasets()
         assert len(split) == 2 and all(split[i] == multi[i] for i in range(multi.ndtset))
@@ -553,6 +657,18 @@ class TestMultiDataset(AbipyTest):
         self.serialize_with_pickle(multi, test_eq=False)
         #self.assertMSONable(multi)
 
+        # Pickle round-trip after to_string (AbinitInput caches data that is not pickled).
+        assert str(multi)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            other = pickle.loads(pickle.dumps(multi, protocol=protocol))
+            assert other.ndtset == multi.ndtset and str(other) == str(multi)
+
+        # Private names and special methods are not forwarded to the inputs.
+        for name in ("__getstate__", "_get_pseudos_json_section"):
+            with self.assertRaises(AttributeError):
+                getattr(multi, name)
+            assert name not in MultiDataset._dispatch_cache
+
         # Test tags
         new_multi.add_tags([GROUND_STATE, RELAX], [0,2])
         assert len(new_multi[0].tags) == 2
@@ -658,6 +774,14 @@ class AnaddbInputTest(AbipyTest):
         assert str(anaddb_input)
         for flag in ('ifcflag', 'dipdip'):
             assert anaddb_input[flag] == 1
+        assert anaddb_input["q1shft"].shape == (1, 3) and anaddb_input["nqshft"] == 1
+        assert anaddb_input["ngqpt"].dtype.kind == "i"
+
+        # The strings of the arrays are cached but in-place modifications must be detected.
+        s = anaddb_input.to_string()
+        assert anaddb_input.to_string() == s
+        anaddb_input["q1shft"][0, 0] = 1
+        assert anaddb_input.to_string() != s
 
         self.serialize_with_pickle(anaddb_input, test_eq=False)
         anaddb_input.deepcopy()
@@ -30,7 +30,7 @@ def make_input(paw=False):
 
     # Global variables
     ecut = 40
-    inp.set_vars(
+    global_vars = dict(
         ecut=ecut,
         pawecutdg=ecut*4 if paw else None,
         nsppol=1,
@@ -46,6 +46,7 @@ def make_input(paw=False):
         tolvrs=1e-8,
         nstep=20,
     )
+    inp.update_vars(global_vars)
 
     return inp
 